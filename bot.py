@@ -2,27 +2,48 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
 import logging
+import logging.handlers
+import atexit
+import queue
 import asyncio
 import json
 import re
-from datetime import datetime, timedelta, time, date
+import sqlite3
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from datetime import datetime, timedelta, time, date, timezone
 from dataclasses import dataclass
 from typing import Dict, Tuple, Optional, List, Any
 from enum import Enum
 
-from openpyxl import Workbook, load_workbook
+try:
+    # orjson заметно быстрее стандартного json, но не обязателен
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # uvloop ускоряет цикл событий asyncio, но есть не на всех платформах
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from cachetools import TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
-    MessageHandler, ConversationHandler, filters, ContextTypes
+    MessageHandler, ConversationHandler, Defaults, AIORateLimiter, filters, ContextTypes
 )
 
 
 # ================== НАСТРОЙКИ ==================
 class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
-    ADMIN_IDS = [6056091640, 8222801796]
+    ADMIN_IDS = frozenset({6056091640, 8222801796})
     DATA_DIR = "data"
     TEMPLATE_FILE = "Табличка для бота по питанию.xlsx"
     ORDERS_FILE = "orders.xlsx"
@@ -30,24 +51,50 @@ class Config:
     SESSIONS_FILE = "sessions.json"
     REMINDERS_FILE = "reminders.json"
     CONNECTIONS_FILE = "connections.json"  # Файл для хранения связей пользователей с учениками
+    DB_FILE = "app.db"  # База заказов и учеников (orders.xlsx формируется из нее)
     DEADLINE_TIME = time(8, 0)  # Дедлайн - 8:00 утра
     REMINDER_TIME = time(7, 0)  # Напоминание в 7:00
     TIMEZONE_OFFSET = 2  # Москва UTC+3
+    FLUSH_INTERVAL = 600  # Как часто сохранять шаблон на диск (секунды)
+    REMINDERS_FLUSH_DELAY = 2  # Задержка сохранения напоминаний после изменения (секунды)
+    SESSION_TTL = 3600  # Время жизни сессии пользователя (секунды)
+    MAX_SESSIONS = 10000  # Максимум одновременно хранимых сессий
+    CONCURRENT_UPDATES = 32  # Сколько обновлений Telegram обрабатывается одновременно
+    CONNECTION_POOL_SIZE = 64  # Размер пула HTTP-соединений к Telegram
+    REMINDER_CONCURRENCY = 25  # Сколько напоминаний отправляется одновременно
 
 
 # Настройка логгирования
+# Запись в файл и консоль идет в отдельном потоке, обработчики только кладут записи в очередь
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    logging.FileHandler('bot.log', encoding='utf-8'),
+    logging.StreamHandler()
+)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
+    handlers=[logging.handlers.QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
 DAY_NAMES_RU = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
+TIMEZONE = timezone(timedelta(hours=Config.TIMEZONE_OFFSET))
+
+# Даты в шаблоне: ГГГГ-ММ-ДД, ДД.ММ.ГГГГ или ДД/ММ/ГГГГ (выражение компилируется один раз)
+DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}|\d{2}([./])\d{2}\1\d{4}')
+DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%d.%m.%Y",
+    "%d/%m/%Y",
+    "%d-%m-%Y"
+)
+
 
 class MealType(Enum):
     BREAKFAST = "breakfast"
@@ -55,16 +102,52 @@ class MealType(Enum):
     SNACK = "snack"
 
 
+# Прием пищи, колонка в структуре шаблона и отметка в ячейке
+MEAL_MARKS = (
+    ("breakfast", "breakfast_col", "З"),
+    ("lunch", "lunch_col", "О"),
+    ("snack", "snack_col", "П")
+)
+
+
 # ================== УТИЛИТЫ ==================
 def get_current_datetime() -> datetime:
     """Получает текущее время с учетом часового пояса"""
-    now = datetime.utcnow() + timedelta(hours=Config.TIMEZONE_OFFSET)
-    return now
+    return datetime.now(TIMEZONE)
+
+
+def parse_date(date_str: str) -> date:
+    """Разбирает дату в формате ГГГГ-ММ-ДД (быстрее, чем strptime)"""
+    return date.fromisoformat(date_str)
+
 
+@lru_cache(maxsize=256)
+def get_week_dates(date_str: str) -> Tuple[date, ...]:
+    """Возвращает даты с понедельника по пятницу недели, в которую входит дата"""
+    day = parse_date(date_str)
+    monday = day.toordinal() - day.weekday()
+    return tuple(date.fromordinal(monday + i) for i in range(5))
 
-def is_date_locked(target_date: date) -> bool:
-    """Проверяет, заблокирована ли дата для редактирования"""
-    now = get_current_datetime()
+
+@lru_cache(maxsize=256)
+def format_date(date_str: str) -> str:
+    """Переводит дату ГГГГ-ММ-ДД в вид ДД.ММ.ГГГГ"""
+    return parse_date(date_str).strftime('%d.%m.%Y')
+
+
+def is_date_locked(target_date: date, now: Optional[datetime] = None) -> bool:
+    """Проверяет, заблокирована ли дата для редактирования (now - уже полученное текущее время)"""
+    if now is None:
+        now = get_current_datetime()
+
+    # Дедлайн задан с точностью до минуты, поэтому результат можно кэшировать поминутно
+    now_minute = now.replace(second=0, microsecond=0)
+    return _is_date_locked_at(target_date, now_minute)
+
+
+@lru_cache(maxsize=512)
+def _is_date_locked_at(target_date: date, now: datetime) -> bool:
+    """Проверяет блокировку даты на заданный момент"""
     today = now.date()
     current_time = now.time()
 
@@ -79,8 +162,37 @@ def is_date_locked(target_date: date) -> bool:
     return False
 
 
+def load_json(path: str) -> Any:
+    """Читает JSON-файл"""
+    if orjson:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def dump_json(data: Any, path: str):
+    """Записывает данные в JSON-файл"""
+    if orjson:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def loads_json(text: str) -> Any:
+    """Разбирает JSON-строку"""
+    return orjson.loads(text) if orjson else json.loads(text)
+
+
+def dumps_json(data: Any) -> str:
+    """Сериализует данные в JSON-строку"""
+    return orjson.dumps(data).decode() if orjson else json.dumps(data, ensure_ascii=False)
+
+
 # ================== МОДЕЛИ ==================
-@dataclass
+@dataclass(slots=True, frozen=True)
 class StudentInfo:
     student_id: str
     full_name: str
@@ -92,13 +204,15 @@ class ReminderManager:
     def __init__(self, reminders_path: str):
         self.reminders_path = reminders_path
         self.reminders = self._load_reminders()
+        # Получатели рассылки: user_id -> привязанный ученик (только с включенными напоминаниями)
+        self.reminder_targets: Dict[int, Dict] = {}
+        self._dirty = False  # Есть несохраненные изменения
 
     def _load_reminders(self) -> Dict:
         """Загружает настройки напоминаний"""
         if os.path.exists(self.reminders_path):
             try:
-                with open(self.reminders_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return load_json(self.reminders_path)
             except Exception as e:
                 logger.error(f"Ошибка загрузки напоминаний: {e}")
         return {}
@@ -106,11 +220,25 @@ class ReminderManager:
     def _save_reminders(self):
         """Сохраняет настройки напоминаний"""
         try:
-            with open(self.reminders_path, 'w', encoding='utf-8') as f:
-                json.dump(self.reminders, f, ensure_ascii=False, indent=2)
+            # Пишем во временный файл и подменяем, чтобы не оставить битый файл
+            tmp_path = f"{self.reminders_path}.tmp"
+            dump_json(dict(self.reminders), tmp_path)
+            os.replace(tmp_path, self.reminders_path)
         except Exception as e:
             logger.error(f"Ошибка сохранения напоминаний: {e}")
 
+    def flush(self) -> bool:
+        """Сохраняет накопленные изменения напоминаний на диск"""
+        if not self._dirty:
+            return False
+        self._dirty = False
+        self._save_reminders()
+        return True
+
+    def has_changes(self) -> bool:
+        """Есть ли несохраненные изменения напоминаний"""
+        return self._dirty
+
     def get_user_reminder(self, user_id: int) -> bool:
         """Получает статус напоминания для пользователя"""
         return self.reminders.get(str(user_id), False)
@@ -118,13 +246,27 @@ class ReminderManager:
     def set_user_reminder(self, user_id: int, enabled: bool):
         """Устанавливает статус напоминания для пользователя"""
         self.reminders[str(user_id)] = enabled
-        self._save_reminders()
+        if not enabled:
+            self.reminder_targets.pop(user_id, None)
+        # Запись на диск выполняет flush()
+        self._dirty = True
         logger.info(f"Напоминание для пользователя {user_id}: {'включено' if enabled else 'выключено'}")
 
     def get_all_users_with_reminders(self) -> List[int]:
         """Получает список всех пользователей с включенными напоминаниями"""
         return [int(user_id) for user_id, enabled in self.reminders.items() if enabled]
 
+    def set_reminder_target(self, user_id: int, connection_info: Optional[Dict]):
+        """Обновляет получателя рассылки после переключения напоминаний или смены связи"""
+        if connection_info and self.get_user_reminder(user_id):
+            self.reminder_targets[user_id] = connection_info
+        else:
+            self.reminder_targets.pop(user_id, None)
+
+    def get_reminder_targets(self) -> List[Tuple[int, Dict]]:
+        """Получает пары (пользователь, привязанный ученик) для рассылки"""
+        return list(self.reminder_targets.items())
+
     def toggle_user_reminder(self, user_id: int) -> bool:
         """Переключает статус напоминания для пользователя"""
         current = self.get_user_reminder(user_id)
@@ -145,8 +287,7 @@ class ConnectionManager:
         """Загружает связи пользователей с учениками"""
         if os.path.exists(self.connections_path):
             try:
-                with open(self.connections_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return load_json(self.connections_path)
             except Exception as e:
                 logger.error(f"Ошибка загрузки связей: {e}")
         return {}
@@ -154,8 +295,7 @@ class ConnectionManager:
     def _save_connections(self):
         """Сохраняет связи пользователей с учениками"""
         try:
-            with open(self.connections_path, 'w', encoding='utf-8') as f:
-                json.dump(self.connections, f, ensure_ascii=False, indent=2)
+            dump_json(self.connections, self.connections_path)
         except Exception as e:
             logger.error(f"Ошибка сохранения связей: {e}")
 
@@ -197,6 +337,9 @@ class TemplateManager:
         self.template_path = template_path
         self.workbook = None
         self.structure = {}
+        self._name_index: Dict[str, Tuple[str, int]] = {}  # ФИО в нижнем регистре -> (лист, строка)
+        self._dirty = False  # Есть несохраненные изменения в шаблоне
+        self._lock = threading.Lock()  # Защищает workbook при изменении и сохранении
 
     def load_template(self) -> bool:
         """Загружает и анализирует шаблон"""
@@ -205,9 +348,16 @@ class TemplateManager:
             return False
 
         try:
+            # openpyxl импортируется долго, поэтому подключаем его только при работе с xlsx
+            from openpyxl import load_workbook
+
             logger.info(f"Загрузка шаблона: {self.template_path}")
-            self.workbook = load_workbook(self.template_path)
-            self.structure = self._analyze_structure()
+            with self._lock:
+                self.workbook = load_workbook(self.template_path)
+                self.structure = self._analyze_structure()
+                self._build_name_index()
+                # Несохраненные изменения старой книги отбрасываем: отметки восстанавливаются из базы
+                self._dirty = False
             logger.info(f"Шаблон загружен успешно. Листов: {len(self.workbook.sheetnames)}")
             return True
         except Exception as e:
@@ -230,10 +380,13 @@ class TemplateManager:
                 'students_start_row': None
             }
 
+            # Шапка листа: колонки A-C первых строк, одним проходом
+            header_rows = list(sheet.iter_rows(min_row=1, max_row=19, max_col=3, values_only=True))
+
             # Ищем строку с датами
-            for row in range(1, 10):
-                cell = sheet.cell(row=row, column=3)  # Колонка C
-                if cell.value and self._is_date(cell.value):
+            for row, values in enumerate(header_rows[:9], start=1):
+                value = values[2]  # Колонка C
+                if value and self._is_date(value):
                     sheet_structure['date_row'] = row
                     logger.info(f"Найдена строка с датами: строка {row}")
                     break
@@ -246,8 +399,8 @@ class TemplateManager:
             self._parse_dates(sheet, sheet_structure)
 
             # Ищем начало списка учеников
-            for row in range(1, 20):
-                if sheet.cell(row=row, column=1).value == "пп":
+            for row, values in enumerate(header_rows, start=1):
+                if values[0] == "пп":
                     sheet_structure['students_start_row'] = row + 1
                     logger.info(f"Начало списка учеников: строка {row + 1}")
                     break
@@ -264,30 +417,24 @@ class TemplateManager:
 
     def _is_date(self, value) -> bool:
         """Проверяет, является ли значение датой"""
-        if isinstance(value, datetime):
+        if value is None:
+            return False
+        # Ячейки с датой openpyxl обычно уже возвращает как datetime
+        if isinstance(value, (datetime, date)):
             return True
 
-        value_str = str(value)
-        date_patterns = [
-            r'\d{4}-\d{2}-\d{2}',
-            r'\d{2}\.\d{2}\.\d{4}',
-            r'\d{2}/\d{2}/\d{4}'
-        ]
-
-        for pattern in date_patterns:
-            if re.search(pattern, value_str):
-                return True
-
-        return False
+        return DATE_RE.search(str(value)) is not None
 
     def _parse_dates(self, sheet, sheet_structure: Dict):
         """Парсит даты из шаблона"""
         date_row = sheet_structure['date_row']
 
+        # Строка с датами целиком, начиная с колонки C
+        row_values = next(sheet.iter_rows(min_row=date_row, max_row=date_row, min_col=3, values_only=True), ())
+
         col = 3  # Начинаем с колонки C
-        while col <= sheet.max_column:
-            date_cell = sheet.cell(row=date_row, column=col)
-            date_value = self._normalize_date(date_cell.value)
+        while col - 3 < len(row_values):
+            date_value = self._normalize_date(row_values[col - 3])
 
             if date_value:
                 sheet_structure['date_columns'][date_value] = {
@@ -304,15 +451,33 @@ class TemplateManager:
         """Парсит список учеников"""
         start_row = sheet_structure['students_start_row']
 
-        for row in range(start_row, sheet.max_row + 1):
-            name_cell = sheet.cell(row=row, column=2)  # Колонка B - ФИО
-            if name_cell.value:
-                student_name = str(name_cell.value).strip()
+        # Колонка B - ФИО
+        for row, (name_value,) in enumerate(
+                sheet.iter_rows(min_row=start_row, min_col=2, max_col=2, values_only=True), start=start_row):
+            if name_value:
+                student_name = str(name_value).strip()
                 if (student_name and
                         student_name != "Итого:" and
                         not student_name.startswith("Всего:")):
                     sheet_structure['students'][student_name] = row
 
+    @staticmethod
+    def _parse_by_shape(value_str: str) -> Optional[str]:
+        """Разбирает дату вида ГГГГ-ММ-ДД, ДД.ММ.ГГГГ, ДД/ММ/ГГГГ или ДД-ММ-ГГГГ"""
+        if len(value_str) != 10:
+            return None
+
+        try:
+            if value_str[4] == '-' and value_str[7] == '-':
+                return date.fromisoformat(value_str).isoformat()
+            separator = value_str[2]
+            if separator in './-' and value_str[5] == separator:
+                return datetime.strptime(value_str, f"%d{separator}%m{separator}%Y").strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+
+        return None
+
     def _normalize_date(self, value) -> Optional[str]:
         """Приводит дату к стандартному формату YYYY-MM-DD"""
         if not value:
@@ -320,7 +485,7 @@ class TemplateManager:
 
         try:
             if isinstance(value, datetime):
-                return value.strftime("%Y-%m-%d")
+                return value.date().isoformat()
 
             value_str = str(value).strip()
 
@@ -328,38 +493,24 @@ class TemplateManager:
             if " 00:00:00" in value_str:
                 value_str = value_str.replace(" 00:00:00", "")
 
-            # Пробуем разные форматы
-            date_formats = [
-                "%Y-%m-%d",
-                "%d.%m.%Y",
-                "%d/%m/%Y",
-                "%d-%m-%Y"
-            ]
+            # Обычно формат понятен по виду строки, и разбирать ее нужно один раз
+            result = self._parse_by_shape(value_str)
+            if result:
+                return result
 
-            for fmt in date_formats:
+            # Пробуем разные форматы
+            for fmt in DATE_FORMATS:
                 try:
                     dt = datetime.strptime(value_str, fmt)
-                    return dt.strftime("%Y-%m-%d")
+                    return dt.date().isoformat()
                 except ValueError:
                     continue
 
             # Пробуем извлечь дату из строки
-            date_patterns = [
-                r'\d{4}-\d{2}-\d{2}',
-                r'\d{2}\.\d{2}\.\d{4}',
-                r'\d{2}/\d{2}/\d{4}'
-            ]
-
-            for pattern in date_patterns:
-                match = re.search(pattern, value_str)
-                if match:
-                    date_str = match.group()
-                    for fmt in date_formats:
-                        try:
-                            dt = datetime.strptime(date_str, fmt)
-                            return dt.strftime("%Y-%m-%d")
-                        except ValueError:
-                            continue
+            for match in DATE_RE.finditer(value_str):
+                result = self._parse_by_shape(match.group())
+                if result:
+                    return result
 
         except Exception as e:
             logger.debug(f"Ошибка нормализации даты '{value}': {e}")
@@ -390,26 +541,11 @@ class TemplateManager:
                 logger.error(f"Дата {date_str} не найдена в листе {sheet_name}")
                 return False
 
-            sheet = self.workbook[sheet_name]
-
-            # Обновляем ячейки
-            if meals.get('breakfast'):
-                sheet.cell(row=student_row, column=date_info['breakfast_col'], value="З")
-            else:
-                sheet.cell(row=student_row, column=date_info['breakfast_col'], value="")
-
-            if meals.get('lunch'):
-                sheet.cell(row=student_row, column=date_info['lunch_col'], value="О")
-            else:
-                sheet.cell(row=student_row, column=date_info['lunch_col'], value="")
-
-            if meals.get('snack'):
-                sheet.cell(row=student_row, column=date_info['snack_col'], value="П")
-            else:
-                sheet.cell(row=student_row, column=date_info['snack_col'], value="")
+            with self._lock:
+                self._write_cells(self.workbook[sheet_name], student_row, date_info, meals)
+                # Запись на диск выполняет flush()
+                self._dirty = True
 
-            # Сохраняем изменения
-            self.workbook.save(self.template_path)
             logger.info(f"Шаблон обновлен: {student_name} - {date_str}")
             return True
 
@@ -417,17 +553,100 @@ class TemplateManager:
             logger.error(f"Ошибка обновления шаблона: {e}", exc_info=True)
             return False
 
-    def find_student(self, student_name: str) -> Tuple[Optional[str], Optional[int]]:
-        """Находит ученика в шаблоне"""
+    def apply_orders(self, orders: List[Tuple[str, str, Dict[str, bool]]]) -> int:
+        """Проставляет в шаблоне заказы (ФИО, дата, питание), возвращает число исправленных"""
+        if not self.workbook:
+            return 0
+
+        changed = 0
+        with self._lock:
+            for student_name, date_str, meals in orders:
+                sheet_name, student_row = self.find_student(student_name)
+                if not sheet_name:
+                    continue
+                date_info = self.structure[sheet_name]['date_columns'].get(date_str)
+                if not date_info:
+                    continue
+                if self._write_cells(self.workbook[sheet_name], student_row, date_info, meals):
+                    changed += 1
+            if changed:
+                # Запись на диск выполняет flush()
+                self._dirty = True
+        return changed
+
+    def _write_cells(self, sheet, student_row: int, date_info: Dict, meals: Dict[str, bool]) -> bool:
+        """Записывает отметки питания ученика на дату, возвращает True, если что-то изменилось"""
+        changed = False
+        for meal, column_key, mark in MEAL_MARKS:
+            cell = sheet.cell(row=student_row, column=date_info[column_key])
+            value = mark if meals.get(meal) else ""
+            if (cell.value or "") != value:
+                cell.value = value
+                changed = True
+        return changed
+
+    def flush(self) -> bool:
+        """Сохраняет накопленные изменения шаблона на диск"""
+        if not self._dirty or not self.workbook:
+            return False
+
+        try:
+            # Пишем во временный файл и подменяем, чтобы не оставить битый шаблон
+            tmp_path = f"{self.template_path}.tmp"
+            with self._lock:
+                self.workbook.save(tmp_path)
+                self._dirty = False
+            os.replace(tmp_path, self.template_path)
+            logger.info("Шаблон сохранен на диск")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения шаблона: {e}", exc_info=True)
+            return False
+
+    def _build_name_index(self):
+        """Строит индекс учеников по ФИО для быстрого поиска"""
+        self._name_index = {}
         for sheet_name, sheet_structure in self.structure.items():
             for name, row in sheet_structure['students'].items():
-                if name.strip().lower() == student_name.strip().lower():
-                    return sheet_name, row
-        return None, None
+                # При совпадении ФИО на разных листах берем первый, как и раньше
+                self._name_index.setdefault(name.strip().lower(), (sheet_name, row))
+
+    def find_student(self, student_name: str) -> Tuple[Optional[str], Optional[int]]:
+        """Находит ученика в шаблоне"""
+        return self._name_index.get(student_name.strip().lower(), (None, None))
 
 
 # ================== БАЗА ДАННЫХ ==================
 class Database:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS students (
+            student_id TEXT PRIMARY KEY,
+            full_name TEXT NOT NULL,
+            class_name TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS orders (
+            student_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            breakfast INTEGER NOT NULL DEFAULT 0,
+            lunch INTEGER NOT NULL DEFAULT 0,
+            snack INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(date);
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_sd ON orders(student_id, date);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    ORDERS_CACHE_SIZE = 10000
+    COUNT_CACHE_SIZE = 366  # Дат в кэше подсчета заказов (около года)
+
     def __init__(self):
         os.makedirs(Config.DATA_DIR, exist_ok=True)
         self.template_path = os.path.join(Config.DATA_DIR, Config.TEMPLATE_FILE)
@@ -435,14 +654,61 @@ class Database:
         self.students_path = os.path.join(Config.DATA_DIR, Config.STUDENTS_FILE)
         self.reminders_path = os.path.join(Config.DATA_DIR, Config.REMINDERS_FILE)
         self.connections_path = os.path.join(Config.DATA_DIR, Config.CONNECTIONS_FILE)
+        self.db_path = os.path.join(Config.DATA_DIR, Config.DB_FILE)
 
         self.template_manager = TemplateManager(self.template_path)
         self.reminder_manager = ReminderManager(self.reminders_path)
         self.connection_manager = ConnectionManager(self.connections_path)
+        for user_id in self.reminder_manager.get_all_users_with_reminders():
+            self.reminder_manager.set_reminder_target(
+                user_id, self.connection_manager.get_student_info_for_user(user_id)
+            )
+
+        # Подключение к SQLite
+        self.conn = self._connect()
+        self._conn_lock = threading.RLock()  # Соединение общее для потока бота и потока базы
+
+        # Кэш учеников: ID -> StudentInfo
+        self._student_cache: Dict[str, StudentInfo] = {}
+        self._students_mtime: Optional[float] = None  # mtime students.xlsx при последней загрузке
+
+        # Кэш заказов: (ID, дата) -> заказ; все записи идут через Database, поэтому он всегда актуален
+        self._orders_cache: Dict[Tuple[str, str], Dict[str, bool]] = {}
+
+        # Кэш подсчета заказов: дата -> количество; сбрасывается при сохранении заказа на дату
+        self._count_cache: Dict[str, Dict[str, int]] = {}
+
+        # Кэш рабочих дат: count -> ((день, прошел ли дедлайн), даты)
+        self._workdates_cache: Dict[int, Tuple[Tuple[date, bool], List[Dict]]] = {}
 
         # Инициализация файлов
         self._init_files()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает базу заказов и создает таблицы"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.SCHEMA)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Выполняет блок запросов в одной транзакции"""
+        with self._conn_lock:
+            self.conn.execute("BEGIN")
+            try:
+                yield self.conn
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def _execute(self, sql: str, params=()) -> List[tuple]:
+        """Выполняет запрос и возвращает все строки результата"""
+        with self._conn_lock:
+            return self.conn.execute(sql, params).fetchall()
+
     def _init_files(self):
         """Инициализация всех файлов"""
         # Проверяем students.xlsx
@@ -454,190 +720,258 @@ class Database:
         if os.path.exists(self.template_path):
             self.template_manager.load_template()
 
-        # Создаем или обновляем orders.xlsx
-        self._create_or_update_orders_file()
+        # Загружаем учеников в базу (если students.xlsx не менялся, берем их из базы)
+        if not self._load_students_from_db():
+            self._load_students()
 
-    def _create_or_update_orders_file(self):
-        """Создает или обновляет файл заказов"""
+        # Переносим заказы из старого orders.xlsx
+        self._import_orders_file()
+
+        # Шаблон сохраняется на диск не сразу, поэтому после сбоя восстанавливаем отметки из базы
+        self._apply_orders_to_template()
+
+    def load_template(self) -> bool:
+        """Перезагружает шаблон и восстанавливает в нем отметки из базы заказов"""
+        if not self.template_manager.load_template():
+            return False
+        self._apply_orders_to_template()
+        return True
+
+    def _apply_orders_to_template(self):
+        """Проставляет в шаблоне все заказы из базы"""
         try:
-            # Загружаем учеников
-            student_wb = load_workbook(self.students_path, data_only=True)
+            rows = self._execute(
+                "SELECT s.full_name, o.date, o.breakfast, o.lunch, o.snack "
+                "FROM orders o JOIN students s ON s.student_id = o.student_id"
+            )
+            changed = self.template_manager.apply_orders([
+                (name, date_str, {'breakfast': bool(b), 'lunch': bool(l), 'snack': bool(s)})
+                for name, date_str, b, l, s in rows
+            ])
+            if changed:
+                logger.info(f"Восстановлено заказов в шаблоне из базы: {changed}")
+        except Exception as e:
+            logger.error(f"Ошибка восстановления шаблона из базы: {e}")
+
+    def _load_students(self):
+        """Загружает список учеников из students.xlsx в базу"""
+        try:
+            from openpyxl import load_workbook
+
+            mtime = os.path.getmtime(self.students_path)
+            student_wb = load_workbook(self.students_path, read_only=True, data_only=True)
             student_ws = student_wb.active
 
             students = []
             for row in student_ws.iter_rows(min_row=2, values_only=True):
                 if row and row[0] and row[1]:
-                    students.append({
-                        'id': str(row[0]),
-                        'name': row[1],
-                        'class': row[2] if len(row) > 2 else ""
-                    })
-
-            # Получаем даты
-            dates = []
-            if self.template_manager.workbook:
-                # Получаем все даты из шаблона
-                all_dates = []
-                for sheet_structure in self.template_manager.structure.values():
-                    all_dates.extend(sheet_structure['date_columns'].keys())
-
-                # Убираем дубликаты и сортируем
-                dates = sorted(list(set(all_dates)))
-                logger.info(f"Загружено {len(dates)} уникальных дат из шаблона")
-
-            if not dates:
-                # Создаем даты на 30 рабочих дней вперед
-                today = datetime.now()
-                added = 0
-                date = today
-                while added < 30:
-                    if date.weekday() < 5:
-                        dates.append(date.strftime("%Y-%m-%d"))
-                        added += 1
-                    date += timedelta(days=1)
-
-            # Проверяем существует ли orders.xlsx
-            if os.path.exists(self.orders_path):
-                self._update_orders_file(students, dates)
-            else:
-                self._create_new_orders_file(students, dates)
+                    students.append((
+                        str(row[0]),
+                        str(row[1]),
+                        str(row[2]) if len(row) > 2 and row[2] else ""
+                    ))
+            student_wb.close()
+
+            with self._transaction() as conn:
+                conn.execute("DELETE FROM students")
+                conn.executemany("INSERT OR REPLACE INTO students VALUES (?, ?, ?)", students)
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('students_mtime', ?)", (repr(mtime),))
+
+            self._student_cache = {row[0]: StudentInfo(*row) for row in students}
+            self._students_mtime = mtime
+
+            logger.info(f"Загружено {len(students)} учеников")
 
         except Exception as e:
-            logger.error(f"Ошибка создания/обновления orders.xlsx: {e}")
+            logger.error(f"Ошибка загрузки учеников: {e}")
 
-    def _create_new_orders_file(self, students: List[Dict], dates: List[str]):
-        """Создает новый файл заказов"""
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Заказы"
+    def _load_students_from_db(self) -> bool:
+        """Берет учеников из базы, если students.xlsx не изменился с прошлого импорта"""
+        try:
+            mtime = os.path.getmtime(self.students_path)
+            rows = self._execute("SELECT value FROM meta WHERE key = 'students_mtime'")
+            if not rows or float(rows[0][0]) != mtime:
+                return False
 
-        # Заголовки
-        headers = ["ID", "ФИО", "Класс"]
-        for date_str in dates:
-            headers.extend([
-                f"{date_str}_breakfast",
-                f"{date_str}_lunch",
-                f"{date_str}_snack"
-            ])
+            students = self._execute("SELECT student_id, full_name, class_name FROM students")
+            self._student_cache = {row[0]: StudentInfo(*row) for row in students}
+            self._students_mtime = mtime
 
-        ws.append(headers)
+            logger.info(f"Загружено {len(students)} учеников из базы")
+            return True
 
-        # Добавляем учеников
-        for student in students:
-            student_row = [student['id'], student['name'], student['class']]
-            student_row.extend([""] * (len(dates) * 3))
-            ws.append(student_row)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки учеников из базы: {e}")
+            return False
 
-        wb.save(self.orders_path)
-        logger.info(f"Создан новый файл orders.xlsx")
+    def _import_orders_file(self):
+        """Переносит заказы из orders.xlsx, если база заказов пуста"""
+        if not os.path.exists(self.orders_path):
+            return
+        if self._execute("SELECT 1 FROM orders LIMIT 1"):
+            return
 
-    def _update_orders_file(self, students: List[Dict], dates: List[str]):
-        """Обновляет существующий файл заказов"""
-        wb = load_workbook(self.orders_path)
-        ws = wb.active
+        try:
+            from openpyxl import load_workbook
 
-        # Получаем текущие заголовки
-        current_headers = []
-        for col in range(1, ws.max_column + 1):
-            current_headers.append(ws.cell(1, col).value)
+            wb = load_workbook(self.orders_path, read_only=True, data_only=True)
+            ws = wb.active
+            rows = ws.iter_rows(values_only=True)
+
+            # Колонки заказов: "ГГГГ-ММ-ДД_прием"
+            columns = {}
+            for idx, header in enumerate(next(rows, ())):
+                if idx >= 3 and header and "_" in str(header):
+                    date_str, meal = str(header).rsplit("_", 1)
+                    if meal in ('breakfast', 'lunch', 'snack'):
+                        columns[idx] = (date_str, meal)
+
+            orders = {}
+            for row in rows:
+                if not row or not row[0]:
+                    continue
+                for idx, (date_str, meal) in columns.items():
+                    if idx < len(row) and row[idx] == "✅":
+                        meals = orders.setdefault((str(row[0]), date_str), self._empty_meals())
+                        meals[meal] = True
+            wb.close()
+
+            with self._transaction() as conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (student_id, date_str, int(m['breakfast']), int(m['lunch']), int(m['snack']))
+                        for (student_id, date_str), m in orders.items()
+                    ]
+                )
 
-        # Добавляем недостающие даты
-        new_dates = []
+            if orders:
+                logger.info(f"Перенесено {len(orders)} заказов из orders.xlsx")
+
+        except Exception as e:
+            logger.error(f"Ошибка переноса заказов из orders.xlsx: {e}")
+
+    def export_orders(self) -> bytes:
+        """Формирует orders.xlsx из базы и возвращает содержимое файла"""
+        from openpyxl import Workbook
+
+        # Даты: из шаблона и из сделанных заказов
+        all_dates = set()
+        for sheet_structure in self.template_manager.structure.values():
+            all_dates.update(sheet_structure['date_columns'].keys())
+        all_dates.update(row[0] for row in self._execute("SELECT DISTINCT date FROM orders"))
+        dates = sorted(all_dates)
+
+        orders = {
+            (student_id, date_str): (breakfast, lunch, snack)
+            for student_id, date_str, breakfast, lunch, snack in self._execute(
+                "SELECT student_id, date, breakfast, lunch, snack FROM orders"
+            )
+        }
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Заказы")
+
+        # Заголовки
+        headers = ["ID", "ФИО", "Класс"]
         for date_str in dates:
-            date_headers = [
+            headers.extend([
                 f"{date_str}_breakfast",
                 f"{date_str}_lunch",
                 f"{date_str}_snack"
-            ]
+            ])
+        ws.append(headers)
 
-            if not all(header in current_headers for header in date_headers):
-                new_dates.append(date_str)
+        # Ученики
+        for student_id, full_name, class_name in self._execute(
+                "SELECT student_id, full_name, class_name FROM students ORDER BY rowid"):
+            student_row = [student_id, full_name, class_name]
+            for date_str in dates:
+                meals = orders.get((student_id, date_str), (0, 0, 0))
+                student_row.extend("✅" if value else "" for value in meals)
+            ws.append(student_row)
 
-        if new_dates:
-            for date_str in new_dates:
-                ws.cell(1, ws.max_column + 1, f"{date_str}_breakfast")
-                ws.cell(1, ws.max_column + 1, f"{date_str}_lunch")
-                ws.cell(1, ws.max_column + 1, f"{date_str}_snack")
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        logger.info(f"Сформирован файл orders.xlsx: {len(dates)} дат")
+        return buffer.getvalue()
 
-            # Добавляем пустые ячейки
-            for row in range(2, ws.max_row + 1):
-                for _ in range(len(new_dates) * 3):
-                    ws.cell(row, ws.max_column + 1, "")
+    def reload_students(self) -> int:
+        """Перечитывает students.xlsx и возвращает число учеников"""
+        self._load_students()
+        return len(self._student_cache)
 
-        wb.save(self.orders_path)
-        if new_dates:
-            logger.info(f"Добавлено {len(new_dates)} новых дат в orders.xlsx")
+    def _reload_students_if_changed(self):
+        """Перечитывает students.xlsx, если файл изменился с последней загрузки"""
+        try:
+            mtime = os.path.getmtime(self.students_path)
+        except OSError:
+            return
+        if mtime != self._students_mtime:
+            logger.info("Файл учеников изменился, перезагружаем")
+            self._load_students()
 
     def verify_student(self, student_id: str) -> Tuple[bool, Optional[StudentInfo]]:
         """Проверяет ученика по ID"""
-        try:
-            wb = load_workbook(self.students_path, data_only=True)
-            ws = wb.active
+        self._reload_students_if_changed()
+        student = self._student_cache.get(student_id)
+        if student:
+            return True, student
 
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                if str(row[0]) == student_id:
-                    return True, StudentInfo(
-                        student_id=str(row[0]),
-                        full_name=row[1],
-                        class_name=row[2] if len(row) > 2 else ""
-                    )
+        try:
+            rows = self._execute(
+                "SELECT student_id, full_name, class_name FROM students WHERE student_id = ?",
+                (student_id,)
+            )
+            if rows:
+                student = StudentInfo(*rows[0])
+                self._student_cache[student_id] = student
+                return True, student
 
         except Exception as e:
             logger.error(f"Ошибка проверки ученика: {e}")
 
         return False, None
 
-    def save_order(self, student_id: str, date_str: str, meals: Dict[str, bool]) -> bool:
-        """Сохраняет заказ ученика"""
+    def toggle_meal(self, student_id: str, date_str: str, meal_type: str,
+                    student: Optional[StudentInfo] = None) -> Optional[Dict[str, bool]]:
+        """Переключает один прием пищи и возвращает новый заказ (None при ошибке)"""
+        orders = self.get_student_orders(student_id, date_str)
+        orders[meal_type] = not orders[meal_type]
+        if not self.save_order(student_id, date_str, orders, student):
+            return None
+        return orders
+
+    def save_order(self, student_id: str, date_str: str, meals: Dict[str, bool],
+                   student: Optional[StudentInfo] = None) -> bool:
+        """Сохраняет заказ ученика (student - уже проверенный ученик, если известен)"""
         try:
             # Проверяем не заблокирована ли дата
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+            target_date = parse_date(date_str)
             if is_date_locked(target_date):
                 logger.warning(f"Попытка сохранить заказ на заблокированную дату: {date_str}")
                 return False
 
-            # 1. Сохраняем в orders.xlsx
-            wb = load_workbook(self.orders_path)
-            ws = wb.active
-
-            # Находим строку ученика
-            student_row = None
-            for r in range(2, ws.max_row + 1):
-                if str(ws.cell(r, 1).value) == student_id:
-                    student_row = r
-                    break
-
-            if not student_row:
-                return False
-
-            # Находим колонки для даты
-            breakfast_col = None
-            lunch_col = None
-            snack_col = None
-
-            for col in range(4, ws.max_column + 1):
-                header = ws.cell(1, col).value
-                if header and date_str in str(header):
-                    if "_breakfast" in str(header):
-                        breakfast_col = col
-                    elif "_lunch" in str(header):
-                        lunch_col = col
-                    elif "_snack" in str(header):
-                        snack_col = col
-
-            if not all([breakfast_col, lunch_col, snack_col]):
-                return False
-
-            # Сохраняем заказы
-            ws.cell(row=student_row, column=breakfast_col, value="✅" if meals.get('breakfast') else "")
-            ws.cell(row=student_row, column=lunch_col, value="✅" if meals.get('lunch') else "")
-            ws.cell(row=student_row, column=snack_col, value="✅" if meals.get('snack') else "")
-
-            wb.save(self.orders_path)
+            if student is None:
+                ok, student = self.verify_student(student_id)
+                if not ok:
+                    return False
+
+            # 1. Сохраняем в базу
+            self._execute(
+                "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)",
+                (
+                    student_id, date_str,
+                    int(bool(meals.get('breakfast'))),
+                    int(bool(meals.get('lunch'))),
+                    int(bool(meals.get('snack')))
+                )
+            )
+            self._cache_orders(student_id, date_str, meals)
+            self._count_cache.pop(date_str, None)
 
             # 2. Обновляем шаблон
-            ok, student = self.verify_student(student_id)
-            if ok and student.full_name:
+            if student.full_name:
                 self.template_manager.update_order(student.full_name, date_str, meals)
 
             logger.info(f"Заказ сохранен: ID {student_id} - {date_str}")
@@ -647,130 +981,297 @@ class Database:
             logger.error(f"Ошибка сохранения заказа: {e}")
             return False
 
-    def get_student_orders(self, student_id: str, date_str: str) -> Dict[str, bool]:
-        """Получает заказы ученика на дату"""
+    def save_orders_bulk(self, student_id: str, updates: List[Tuple[str, Dict[str, bool]]],
+                         student: Optional[StudentInfo] = None) -> int:
+        """Сохраняет заказы ученика на несколько дат одной транзакцией, возвращает число сохраненных дат"""
         try:
-            wb = load_workbook(self.orders_path, data_only=True)
-            ws = wb.active
+            if student is None:
+                ok, student = self.verify_student(student_id)
+                if not ok:
+                    return 0
+
+            rows = []
+            saved = []
+            for date_str, meals in updates:
+                target_date = parse_date(date_str)
+                if is_date_locked(target_date):
+                    logger.debug(f"Пропущена заблокированная дата: {date_str}")
+                    continue
+                saved.append((date_str, meals))
+                rows.append((
+                    student_id, date_str,
+                    int(bool(meals.get('breakfast'))),
+                    int(bool(meals.get('lunch'))),
+                    int(bool(meals.get('snack')))
+                ))
+
+            if not rows:
+                return 0
+
+            with self._transaction() as conn:
+                conn.executemany("INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)", rows)
+            for date_str, meals in saved:
+                self._cache_orders(student_id, date_str, meals)
+                self._count_cache.pop(date_str, None)
+
+            if student.full_name:
+                for date_str, meals in saved:
+                    self.template_manager.update_order(student.full_name, date_str, meals)
+
+            logger.info(f"Заказы сохранены: ID {student_id} - {len(rows)} дат")
+            return len(rows)
 
-            # Находим строку ученика
-            student_row = None
-            for r in range(2, ws.max_row + 1):
-                if str(ws.cell(r, 1).value) == student_id:
-                    student_row = r
-                    break
+        except Exception as e:
+            logger.error(f"Ошибка сохранения заказов: {e}")
+            return 0
+
+    def get_student_orders(self, student_id: str, date_str: str) -> Dict[str, bool]:
+        """Получает заказы ученика на дату"""
+        cached = self._orders_cache.get((student_id, date_str))
+        if cached is not None:
+            return dict(cached)
 
-            if not student_row:
-                return self._empty_meals()
+        try:
+            rows = self._execute(
+                "SELECT breakfast, lunch, snack FROM orders WHERE student_id = ? AND date = ?",
+                (student_id, date_str)
+            )
 
-            # Находим колонки для даты
-            breakfast_col = None
-            lunch_col = None
-            snack_col = None
-
-            for col in range(4, ws.max_column + 1):
-                header = ws.cell(1, col).value
-                if header and date_str in str(header):
-                    if "_breakfast" in str(header):
-                        breakfast_col = col
-                    elif "_lunch" in str(header):
-                        lunch_col = col
-                    elif "_snack" in str(header):
-                        snack_col = col
-
-            if not all([breakfast_col, lunch_col, snack_col]):
-                return self._empty_meals()
-
-            # Получаем заказы
-            orders = {
-                'breakfast': ws.cell(row=student_row, column=breakfast_col).value == "✅",
-                'lunch': ws.cell(row=student_row, column=lunch_col).value == "✅",
-                'snack': ws.cell(row=student_row, column=snack_col).value == "✅"
-            }
+            if not rows:
+                orders = self._empty_meals()
+            else:
+                row = rows[0]
+                orders = {
+                    'breakfast': bool(row[0]),
+                    'lunch': bool(row[1]),
+                    'snack': bool(row[2])
+                }
 
+            self._cache_orders(student_id, date_str, orders)
             return orders
 
         except Exception as e:
             logger.error(f"Ошибка получения заказов: {e}")
             return self._empty_meals()
 
+    def _cache_orders(self, student_id: str, date_str: str, meals: Dict[str, bool]):
+        """Запоминает заказ ученика на дату"""
+        if len(self._orders_cache) >= self.ORDERS_CACHE_SIZE:
+            self._orders_cache.clear()
+        self._orders_cache[(student_id, date_str)] = {meal.value: bool(meals.get(meal.value)) for meal in MealType}
+
     def _empty_meals(self) -> Dict[str, bool]:
         return {meal.value: False for meal in MealType}
 
     def count_for_date(self, date_str: str) -> Dict[str, int]:
         """Подсчет заказов на дату"""
-        try:
-            wb = load_workbook(self.orders_path, data_only=True)
-            ws = wb.active
+        return self.count_for_dates([date_str])[date_str]
 
-            # Находим колонки для даты
-            breakfast_col = None
-            lunch_col = None
-            snack_col = None
-
-            for col in range(4, ws.max_column + 1):
-                header = ws.cell(1, col).value
-                if header and date_str in str(header):
-                    if "_breakfast" in str(header):
-                        breakfast_col = col
-                    elif "_lunch" in str(header):
-                        lunch_col = col
-                    elif "_snack" in str(header):
-                        snack_col = col
-
-            if not all([breakfast_col, lunch_col, snack_col]):
-                return {meal.value: 0 for meal in MealType}
-
-            # Подсчитываем
-            counts = {meal.value: 0 for meal in MealType}
-            for row in range(2, ws.max_row + 1):
-                if ws.cell(row, breakfast_col).value == "✅":
-                    counts['breakfast'] += 1
-                if ws.cell(row, lunch_col).value == "✅":
-                    counts['lunch'] += 1
-                if ws.cell(row, snack_col).value == "✅":
-                    counts['snack'] += 1
-
-            return counts
+    def count_for_dates(self, date_strs: List[str]) -> Dict[str, Dict[str, int]]:
+        """Подсчет заказов сразу на несколько дат одним запросом"""
+        counts = {date_str: {meal.value: 0 for meal in MealType} for date_str in date_strs}
 
-        except Exception as e:
-            logger.error(f"Ошибка подсчета заказов: {e}")
-            return {meal.value: 0 for meal in MealType}
+        # Считаем только даты, которых нет в кэше
+        missing = [date_str for date_str in date_strs if date_str not in self._count_cache]
+        if missing:
+            try:
+                placeholders = ", ".join("?" * len(missing))
+                found = {
+                    date_str: {'breakfast': breakfast, 'lunch': lunch, 'snack': snack}
+                    for date_str, breakfast, lunch, snack in self._execute(
+                        "SELECT date, SUM(breakfast), SUM(lunch), SUM(snack) "
+                        f"FROM orders WHERE date IN ({placeholders}) GROUP BY date",
+                        missing)
+                }
+                # Старые даты больше не запрашиваются, поэтому при переполнении кэш просто сбрасываем
+                if len(self._count_cache) + len(missing) > self.COUNT_CACHE_SIZE:
+                    self._count_cache.clear()
+                for date_str in missing:
+                    self._count_cache[date_str] = found.get(date_str, counts[date_str])
+
+            except Exception as e:
+                logger.error(f"Ошибка подсчета заказов: {e}")
+
+        for date_str in date_strs:
+            if date_str in self._count_cache:
+                counts[date_str] = dict(self._count_cache[date_str])
+
+        return counts
 
     def get_working_dates(self, count: int = 10) -> List[Dict[str, str]]:
         """Получает список рабочих дат с проверкой блокировки"""
-        dates = []
-        today = get_current_datetime()
-        added = 0
-        current_date = today
-
-        while added < count:
-            if current_date.weekday() < 5:  # Только будни
-                date_str = current_date.strftime("%Y-%m-%d")
-                date_obj = current_date.date()
-
-                dates.append({
-                    'date_str': date_str,
-                    'display': f"{current_date.strftime('%d.%m')} ({DAY_NAMES_RU[current_date.weekday()]})",
-                    'is_locked': is_date_locked(date_obj)
-                })
-                added += 1
-            current_date += timedelta(days=1)
+        now = get_current_datetime()
+        today = now.date()
+
+        # Список меняется только со сменой дня или когда наступает дедлайн на сегодня
+        key = (today, now.time() >= Config.DEADLINE_TIME)
+        cached_key, dates = self._workdates_cache.get(count, (None, None))
+        if cached_key != key:
+            dates = [
+                {'date_str': date_str, 'display': display, 'is_locked': is_date_locked(date_obj, now)}
+                for date_obj, date_str, display in self._build_working_calendar(today, count)
+            ]
+            self._workdates_cache[count] = (key, dates)
 
         return dates
 
+    @staticmethod
+    def _build_working_calendar(today: date, count: int) -> List[Tuple[date, str, str]]:
+        """Строит список рабочих дат начиная с сегодняшнего дня"""
+        calendar = []
+
+        # Первый будний день: с субботы и воскресенья переходим на понедельник
+        first = today + timedelta(days=7 - today.weekday() if today.weekday() >= 5 else 0)
+        first_weekday = first.weekday()
+
+        for i in range(count):
+            # i-й будний день после first: каждые полные 5 будней добавляют 2 выходных
+            current_date = first + timedelta(days=i + 2 * ((first_weekday + i) // 5))
+            calendar.append((
+                current_date,
+                current_date.isoformat(),
+                f"{current_date.strftime('%d.%m')} ({DAY_NAMES_RU[current_date.weekday()]})"
+            ))
+
+        return calendar
+
+    def students_without_order_for(self, date_str: str, student_ids: List[str]) -> set:
+        """Возвращает ID учеников из списка, у которых нет заказа на дату"""
+        try:
+            ordered = {
+                row[0] for row in self._execute(
+                    "SELECT student_id FROM orders WHERE date = ? AND (breakfast OR lunch OR snack)",
+                    (date_str,)
+                )
+            }
+        except Exception as e:
+            logger.error(f"Ошибка проверки заказов на {date_str}: {e}")
+            return set()
+
+        return set(student_ids) - ordered
+
+    def load_session(self, user_id: int, max_age: int) -> Optional[Dict]:
+        """Загружает сохраненную сессию пользователя, если она не старше max_age секунд"""
+        try:
+            rows = self._execute(
+                "SELECT data FROM sessions WHERE user_id = ? AND updated_at > ?",
+                (user_id, get_current_datetime().timestamp() - max_age)
+            )
+            return loads_json(rows[0][0]) if rows else None
+        except Exception as e:
+            logger.error(f"Ошибка загрузки сессии {user_id}: {e}")
+            return None
+
+    def save_session(self, user_id: int, data: Dict):
+        """Сохраняет сессию пользователя"""
+        try:
+            self._execute(
+                "INSERT OR REPLACE INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, dumps_json(data), get_current_datetime().timestamp())
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сессии {user_id}: {e}")
+
+    def touch_session(self, user_id: int):
+        """Продлевает сохраненную сессию пользователя"""
+        try:
+            self._execute(
+                "UPDATE sessions SET updated_at = ? WHERE user_id = ?",
+                (get_current_datetime().timestamp(), user_id)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка продления сессии {user_id}: {e}")
+
+    def purge_sessions(self, max_age: int) -> int:
+        """Удаляет сессии старше max_age секунд"""
+        with self._conn_lock:
+            return self.conn.execute(
+                "DELETE FROM sessions WHERE updated_at <= ?",
+                (get_current_datetime().timestamp() - max_age,)
+            ).rowcount
+
     def check_tomorrow_order(self, student_id: str) -> bool:
         """Проверяет, есть ли заказ на завтра"""
-        tomorrow = (get_current_datetime() + timedelta(days=1)).strftime("%Y-%m-%d")
+        tomorrow = (get_current_datetime().date() + timedelta(days=1)).isoformat()
         orders = self.get_student_orders(student_id, tomorrow)
 
         # Проверяем, есть ли хотя бы один заказ
         return any(orders.values())
 
 
+# ================== СЕССИИ ==================
+class SessionStore:
+    """Сессии пользователей: кэш в памяти с записью в базу, чтобы пережить перезапуск"""
+
+    # В базе храним только эти поля, данные ученика восстанавливаются по его ID
+    PERSISTED_KEYS = ('state', 'student_id')
+
+    # Как часто продлевать сессию в базе при активности пользователя (секунды)
+    TOUCH_INTERVAL = Config.SESSION_TTL // 10
+
+    def __init__(self, db: Database, executor: ThreadPoolExecutor):
+        self.db = db
+        # Запросы к базе идут в потоке базы, чтобы не блокировать бота
+        self._executor = executor
+        # Неактивные сессии удаляются из памяти сами, память не растет бесконечно
+        self._cache = TTLCache(maxsize=Config.MAX_SESSIONS, ttl=Config.SESSION_TTL)
+        # Недавно продленные сессии, чтобы не писать в базу на каждое нажатие
+        self._touched = TTLCache(maxsize=Config.MAX_SESSIONS, ttl=self.TOUCH_INTERVAL)
+
+    async def get(self, user_id: int) -> Optional[Dict]:
+        """Возвращает сессию из памяти или восстанавливает ее из базы"""
+        session = self._cache.get(user_id)
+        if session is None:
+            loop = asyncio.get_running_loop()
+            session = await loop.run_in_executor(self._executor, self._restore, user_id)
+            if session is None:
+                return None
+        elif user_id in self._touched:
+            return session
+        else:
+            self._executor.submit(self.db.touch_session, user_id)
+
+        # Активная сессия живет SESSION_TTL с последнего обращения
+        self._cache[user_id] = session
+        self._touched[user_id] = True
+        return session
+
+    def _restore(self, user_id: int) -> Optional[Dict]:
+        """Восстанавливает сессию из базы (в потоке базы)"""
+        data = self.db.load_session(user_id, Config.SESSION_TTL)
+        if data is None:
+            return None
+        self.db.touch_session(user_id)
+
+        session = {'state': data.get('state', 'main')}
+        student_id = data.get('student_id')
+        if student_id:
+            ok, student = self.db.verify_student(student_id)
+            if ok:
+                session.update(
+                    student_id=student_id,
+                    student_name=student.full_name,
+                    class_name=student.class_name,
+                    student=student
+                )
+        return session
+
+    def __setitem__(self, user_id: int, session: Dict):
+        self._cache[user_id] = session
+        self._touched[user_id] = True
+        # Запись в базу не ждем: поток базы выполнит ее по очереди с остальными операциями
+        data = {key: session[key] for key in self.PERSISTED_KEYS if key in session}
+        self._executor.submit(self.db.save_session, user_id, data)
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+
 # ================== КНОПКИ ==================
 class KB:
+    # Клавиатуры неизменяемы, поэтому одинаковые наборы кнопок строятся один раз
     @staticmethod
+    @lru_cache(maxsize=2)
     def main(has_reminder: bool = False):
         buttons = [
             [InlineKeyboardButton("🔑 Ввести ID ученика", callback_data="input_id")],
@@ -780,15 +1281,22 @@ class KB:
 
     @staticmethod
     def dates(dates_list: List[Dict[str, str]]):
+        return KB._dates(tuple(
+            (date_info['date_str'], date_info['display'], date_info['is_locked'])
+            for date_info in dates_list
+        ))
+
+    @staticmethod
+    @lru_cache(maxsize=4)
+    def _dates(dates_key: Tuple[Tuple[str, str, bool], ...]):
         keyboard = []
-        for date_info in dates_list:
-            display = date_info['display']
-            if date_info['is_locked']:
+        for date_str, display, is_locked in dates_key:
+            if is_locked:
                 display = f"🔒 {display}"
             keyboard.append([
                 InlineKeyboardButton(
                     display,
-                    callback_data=f"date|{date_info['date_str']}"
+                    callback_data=f"date|{date_str}"
                 )
             ])
         keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_main")])
@@ -796,11 +1304,21 @@ class KB:
 
     @staticmethod
     def meals(date_str: str, current_orders: Dict[str, bool]):
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        date_display = f"{date_obj.strftime('%d.%m.%Y')} ({DAY_NAMES_RU[date_obj.weekday()]})"
-
         # Проверяем блокировку
-        is_locked = is_date_locked(date_obj.date())
+        is_locked = is_date_locked(parse_date(date_str))
+
+        return KB._meals(
+            date_str,
+            (current_orders['breakfast'], current_orders['lunch'], current_orders['snack']),
+            is_locked
+        )
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _meals(date_str: str, orders_key: Tuple[bool, bool, bool], is_locked: bool):
+        date_obj = parse_date(date_str)
+        date_display = f"{date_obj.strftime('%d.%m.%Y')} ({DAY_NAMES_RU[date_obj.weekday()]})"
+        current_orders = dict(zip(('breakfast', 'lunch', 'snack'), orders_key))
 
         if is_locked:
             text = f"📅 {date_display}\n🔒 Редактирование закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})\n\nТекущий заказ:"
@@ -846,6 +1364,7 @@ class KB:
         return InlineKeyboardMarkup(buttons)
 
     @staticmethod
+    @lru_cache(maxsize=2)
     def stats(is_admin: bool):
         buttons = []
         if is_admin:
@@ -866,11 +1385,183 @@ class KB:
 class FoodBot:
     INPUT_ID, DATES, MEALS = range(3)
 
+    # Кнопки, доступные только администраторам
+    ADMIN_ACTIONS = frozenset({"download_orders", "download_template", "refresh_data"})
+
     def __init__(self, application: Application):
         self.db = Database()
-        self.user_sessions = {}
+        # Один поток для работы с базой: операции не блокируют бота и идут по очереди
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        # Сессии пользователей: в памяти с записью в базу
+        self.user_sessions = SessionStore(self.db, self._db_executor)
+        # Блокировки пользователей: user_id -> [блокировка, сколько обработчиков ее держат или ждут]
+        self._user_locks: Dict[int, List] = {}
         self.application = application
 
+        # Обработчики кнопок по действию из callback_data
+        self._button_handlers = {
+            "input_id": self._handle_input_id,
+            "toggle_reminder": self._handle_toggle_reminder,
+            "stats": self._handle_stats,
+            "download_orders": self._handle_download_orders,
+            "download_template": self._handle_download_template,
+            "refresh_data": self._handle_refresh_data,
+            "back_main": self._handle_back_main,
+            "back_dates": self._handle_back_dates,
+            "date": self._handle_date,
+            "locked": self._handle_locked,
+            "meal": self._handle_meal,
+            "all_day": self._handle_all_day,
+            "none_day": self._handle_none_day,
+            "all_week": self._handle_all_week,
+            "clear_week": self._handle_clear_week,
+        }
+        self._flush_task: Optional[asyncio.Task] = None
+        self._reminders_flush_task: Optional[asyncio.Task] = None
+        self._background_tasks = set()  # Ссылки на фоновые задачи, чтобы их не собрал GC
+        self._file_cache: Dict[str, Tuple[float, bytes]] = {}  # Путь -> (mtime, содержимое)
+        # Последний показанный текст и кнопки каждого сообщения, чтобы не отправлять одинаковые правки
+        self._last_render = TTLCache(maxsize=Config.MAX_SESSIONS, ttl=Config.SESSION_TTL)
+
+    async def post_init(self, application: Application):
+        """Запускает фоновое сохранение шаблона и ежедневные напоминания"""
+        self._flush_task = asyncio.create_task(self._flush_loop())
+        self._flush_task.add_done_callback(self._on_flush_loop_done)
+        self._setup_reminder_job(application)
+
+    def _setup_reminder_job(self, application: Application):
+        """Планирует отправку напоминаний раз в день в REMINDER_TIME"""
+        if application.job_queue is None:
+            logger.warning("JobQueue недоступна (нужен python-telegram-bot[job-queue]), напоминания отключены")
+            return
+
+        application.job_queue.run_daily(
+            self.send_reminders,
+            time=Config.REMINDER_TIME.replace(tzinfo=TIMEZONE),
+            name="reminders"
+        )
+        logger.info(f"Напоминания запланированы на {Config.REMINDER_TIME.strftime('%H:%M')}")
+
+    async def send_reminders(self, context: ContextTypes.DEFAULT_TYPE) -> int:
+        """Напоминает о заказе на завтра тем, у кого он не сделан; возвращает число отправленных"""
+        tomorrow = get_current_datetime().date() + timedelta(days=1)
+        if tomorrow.weekday() >= 5:
+            return 0
+
+        # Пользователи с напоминаниями и привязанным учеником
+        targets = self.db.reminder_manager.get_reminder_targets()
+
+        # Заказы на завтра проверяем одним запросом для всех
+        without_order = await self._run_db(
+            self.db.students_without_order_for,
+            tomorrow.isoformat(),
+            [connection_info['student_id'] for _, connection_info in targets]
+        )
+
+        recipients = [
+            (user_id, connection_info) for user_id, connection_info in targets
+            if connection_info['student_id'] in without_order
+        ]
+
+        # Отправляем параллельно, ограничивая число одновременных запросов
+        semaphore = asyncio.Semaphore(Config.REMINDER_CONCURRENCY)
+        results = await asyncio.gather(
+            *(
+                self._send_one_reminder(semaphore, context, user_id, connection_info, tomorrow)
+                for user_id, connection_info in recipients
+            ),
+            return_exceptions=True
+        )
+
+        sent = 0
+        for (user_id, _), result in zip(recipients, results):
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {result}")
+            else:
+                sent += 1
+
+        logger.info(f"Отправлено напоминаний: {sent}")
+        return sent
+
+    async def _send_one_reminder(self, semaphore: asyncio.Semaphore, context: ContextTypes.DEFAULT_TYPE,
+                                 user_id: int, connection_info: Dict, tomorrow: date):
+        """Отправляет одно напоминание о заказе на завтра"""
+        async with semaphore:
+            await context.bot.send_message(
+                chat_id=user_id,
+                text=(
+                    f"🔔 **Напоминание**\n\n"
+                    f"На завтра ({tomorrow.strftime('%d.%m.%Y')}) не заказано питание\n"
+                    f"👤 {connection_info['student_name']}\n\n"
+                    f"Сделать заказ: /start"
+                ),
+                parse_mode='Markdown'
+            )
+
+    async def post_shutdown(self, application: Application):
+        """Останавливает фоновое сохранение и записывает последние изменения"""
+        tasks = [task for task in (self._flush_task, self._reminders_flush_task) if task]
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся остановки задач, чтобы они не обратились к потоку базы после его закрытия
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._db_executor.shutdown(wait=True)
+        self.db.template_manager.flush()
+        self.db.reminder_manager.flush()
+
+    async def _run_db(self, func, *args):
+        """Выполняет операцию с базой в отдельном потоке"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, func, *args)
+
+    def _read_file_cached(self, path: str) -> Optional[bytes]:
+        """Читает файл, повторно используя содержимое, пока файл не изменился (None, если файла нет)"""
+        if not os.path.exists(path):
+            return None
+
+        mtime = os.path.getmtime(path)
+        cached = self._file_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        self._file_cache[path] = (mtime, data)
+        return data
+
+    def _schedule_reminders_flush(self):
+        """Планирует сохранение напоминаний: несколько переключений подряд пишутся одним разом"""
+        if self._reminders_flush_task and not self._reminders_flush_task.done():
+            return
+        self._reminders_flush_task = asyncio.create_task(self._flush_reminders_later())
+
+    async def _flush_reminders_later(self):
+        """Сохраняет напоминания после короткой паузы"""
+        # Переключения во время записи снова помечают изменения, их сохраняем следующим проходом
+        while True:
+            await asyncio.sleep(Config.REMINDERS_FLUSH_DELAY)
+            await self._run_db(self.db.reminder_manager.flush)
+            if not self.db.reminder_manager.has_changes():
+                break
+
+    async def _flush_loop(self):
+        """Периодически сохраняет шаблон на диск"""
+        while True:
+            await asyncio.sleep(Config.FLUSH_INTERVAL)
+            try:
+                # Сжатие xlsx занимает время, поэтому сохраняем в потоке базы, не блокируя бота
+                await self._run_db(self.db.template_manager.flush)
+                await self._run_db(self.db.purge_sessions, Config.SESSION_TTL)
+            except Exception:
+                # Ошибка одного прохода не должна останавливать сохранение
+                logger.exception("Ошибка фонового сохранения")
+
+    def _on_flush_loop_done(self, task: asyncio.Task):
+        """Пишет в лог, если фоновое сохранение остановилось не при выключении бота"""
+        if task.cancelled():
+            return
+        logger.error("Фоновое сохранение шаблона остановлено", exc_info=task.exception())
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
@@ -907,347 +1598,381 @@ class FoodBot:
         await query.answer()
 
         user_id = query.from_user.id
-        data = query.data
-
-        if data == "input_id":
-            await query.edit_message_text(
-                "🔑 **Введите ID ученика**\n\n"
-                "ID можно получить у классного руководителя.\n"
-                "**Введите ID:**",
-                parse_mode='Markdown'
-            )
-            return self.INPUT_ID
 
-        elif data == "toggle_reminder":
-            # Переключаем напоминание
-            new_state = self.db.reminder_manager.toggle_user_reminder(user_id)
-
-            now = get_current_datetime()
-            await query.edit_message_text(
-                f"🏫 **Система заказа школьного питания**\n\n"
-                f"📅 Сегодня: {now.strftime('%d.%m.%Y')}\n"
-                f"Выберите действие:",
-                parse_mode='Markdown',
-                reply_markup=KB.main(new_state)
-            )
+        # Нажатия одного пользователя обрабатываем по очереди, чтобы не потерять изменения
+        async with self._user_lock(user_id):
+            return await self._handle_button(query, user_id, query.data, context)
+
+    @asynccontextmanager
+    async def _user_lock(self, user_id: int):
+        """Держит блокировку сессии пользователя; удаляет ее, когда она больше никому не нужна"""
+        entry = self._user_locks.get(user_id)
+        if entry is None:
+            entry = self._user_locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user_id]
+
+    async def _handle_button(self, query, user_id: int, data: str, context: ContextTypes.DEFAULT_TYPE):
+        """Выполняет действие нажатой кнопки"""
+        # callback_data: "действие" или "действие|аргументы"
+        action, _, arg = data.partition("|")
+        if action in self.ADMIN_ACTIONS and user_id not in Config.ADMIN_IDS:
+            return
+        handler = self._button_handlers.get(action)
+        if handler:
+            return await handler(query, user_id, arg, context)
+
+    async def _edit_text(self, query, text: str, reply_markup=None, parse_mode: Optional[str] = None):
+        """Меняет текст сообщения, если он или кнопки отличаются от показанных"""
+        key = (query.message.chat_id, query.message.message_id)
+        if self._last_render.get(key) == (text, reply_markup):
             return
+        await query.edit_message_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        self._last_render[key] = (text, reply_markup)
+
+    async def _edit_markup(self, query, reply_markup):
+        """Меняет кнопки сообщения, если они отличаются от показанных"""
+        key = (query.message.chat_id, query.message.message_id)
+        last_text, last_markup = self._last_render.get(key, (None, None))
+        if last_markup is not None and last_markup == reply_markup:
+            return
+        await query.edit_message_reply_markup(reply_markup)
+        self._last_render[key] = (last_text, reply_markup)
+
+    async def _handle_input_id(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Запрашивает ID ученика"""
+        await self._edit_text(
+            query,
+            "🔑 **Введите ID ученика**\n\n"
+            "ID можно получить у классного руководителя.\n"
+            "**Введите ID:**",
+            parse_mode='Markdown'
+        )
+        return self.INPUT_ID
+
+    async def _handle_toggle_reminder(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Переключает напоминания"""
+        # Переключаем напоминание
+        new_state = self.db.reminder_manager.toggle_user_reminder(user_id)
+        self.db.reminder_manager.set_reminder_target(
+            user_id, self.db.connection_manager.get_student_info_for_user(user_id)
+        )
+        self._schedule_reminders_flush()
 
-        elif data == "stats":
-            if user_id not in Config.ADMIN_IDS:
-                await query.edit_message_text(
-                    "❌ У вас нет доступа к статистике",
-                    reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
-                )
-                return
-
-            # Получаем статистику
-            today = get_current_datetime().strftime("%Y-%m-%d")
-            tomorrow = (get_current_datetime() + timedelta(days=1)).strftime("%Y-%m-%d")
-
-            today_stats = self.db.count_for_date(today)
-            tomorrow_stats = self.db.count_for_date(tomorrow)
-
-            text = (
-                "📊 **Статистика заказов**\n\n"
-                f"**Сегодня ({get_current_datetime().strftime('%d.%m')}):**\n"
-                f"🍳 Завтрак: {today_stats['breakfast']}\n"
-                f"🍲 Обед: {today_stats['lunch']}\n"
-                f"🥪 Полдник: {today_stats['snack']}\n\n"
-                f"**Завтра ({datetime.fromisoformat(tomorrow).strftime('%d.%m')}):**\n"
-                f"🍳 Завтрак: {tomorrow_stats['breakfast']}\n"
-                f"🍲 Обед: {tomorrow_stats['lunch']}\n"
-                f"🥪 Полдник: {tomorrow_stats['snack']}"
-            )
+        now = get_current_datetime()
+        await self._edit_text(
+            query,
+            f"🏫 **Система заказа школьного питания**\n\n"
+            f"📅 Сегодня: {now.strftime('%d.%m.%Y')}\n"
+            f"Выберите действие:",
+            parse_mode='Markdown',
+            reply_markup=KB.main(new_state)
+        )
+        return
 
-            await query.edit_message_text(
-                text,
-                parse_mode='Markdown',
-                reply_markup=KB.stats(is_admin=True)
+    async def _handle_stats(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает статистику заказов"""
+        if user_id not in Config.ADMIN_IDS:
+            await self._edit_text(
+                query,
+                "❌ У вас нет доступа к статистике",
+                reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
             )
+            return
 
-        elif data == "download_orders":
-            if user_id not in Config.ADMIN_IDS:
-                return
+        # Получаем статистику (время берем один раз)
+        today_dt = get_current_datetime().date()
+        tomorrow_dt = today_dt + timedelta(days=1)
+        today = today_dt.isoformat()
+        tomorrow = tomorrow_dt.isoformat()
+
+        stats = await self._run_db(self.db.count_for_dates, [today, tomorrow])
+        today_stats = stats[today]
+        tomorrow_stats = stats[tomorrow]
+
+        text = (
+            "📊 **Статистика заказов**\n\n"
+            f"**Сегодня ({today_dt.strftime('%d.%m')}):**\n"
+            f"🍳 Завтрак: {today_stats['breakfast']}\n"
+            f"🍲 Обед: {today_stats['lunch']}\n"
+            f"🥪 Полдник: {today_stats['snack']}\n\n"
+            f"**Завтра ({tomorrow_dt.strftime('%d.%m')}):**\n"
+            f"🍳 Завтрак: {tomorrow_stats['breakfast']}\n"
+            f"🍲 Обед: {tomorrow_stats['lunch']}\n"
+            f"🥪 Полдник: {tomorrow_stats['snack']}"
+        )
 
-            if os.path.exists(self.db.orders_path):
-                await query.message.reply_document(
-                    document=open(self.db.orders_path, 'rb'),
-                    filename="orders.xlsx",
-                    caption="📊 Файл заказов"
-                )
+        await self._edit_text(
+            query,
+            text,
+            parse_mode='Markdown',
+            reply_markup=KB.stats(is_admin=True)
+        )
 
-        elif data == "download_template":
-            if user_id not in Config.ADMIN_IDS:
-                return
+    async def _handle_download_orders(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Отправляет файл заказов (админ)"""
+        # Формирование файла не должно блокировать остальных пользователей
+        orders_data = await self._run_db(self.db.export_orders)
+        await query.message.reply_document(
+            document=orders_data,
+            filename="orders.xlsx",
+            caption="📊 Файл заказов"
+        )
 
-            if os.path.exists(self.db.template_path):
-                await query.message.reply_document(
-                    document=open(self.db.template_path, 'rb'),
-                    filename=Config.TEMPLATE_FILE,
-                    caption="📋 Основной шаблон"
-                )
+    async def _handle_download_template(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Отправляет шаблон (админ)"""
+        await self._run_db(self.db.template_manager.flush)
+        # Проверка и чтение файла тоже идут в потоке базы, чтобы не блокировать бота
+        template_data = await self._run_db(self._read_file_cached, self.db.template_path)
+        if template_data is not None:
+            await query.message.reply_document(
+                document=template_data,
+                filename=Config.TEMPLATE_FILE,
+                caption="📋 Основной шаблон"
+            )
 
-        elif data == "refresh_data":
-            if user_id not in Config.ADMIN_IDS:
-                return
+    async def _handle_refresh_data(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Перезагружает шаблон и список учеников (админ)"""
+        # Перезагружаем шаблон и индекс учеников
+        if await self._run_db(self.db.load_template):
+            await self._run_db(self.db.reload_students)
+            await self._send_temp_message(
+                query.message.chat_id,
+                "✅ Данные обновлены",
+                context
+            )
+        else:
+            await self._send_temp_message(
+                query.message.chat_id,
+                "❌ Ошибка обновления данных",
+                context
+            )
 
-            # Перезагружаем шаблон
-            if self.db.template_manager.load_template():
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "✅ Данные обновлены",
-                    context
-                )
-            else:
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "❌ Ошибка обновления данных",
-                    context
-                )
+    async def _handle_back_main(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Возвращает в главное меню"""
+        if await self.user_sessions.get(user_id) is not None:
+            self.user_sessions[user_id] = {'state': 'main'}
 
-        elif data == "back_main":
-            if user_id in self.user_sessions:
-                self.user_sessions[user_id] = {'state': 'main'}
+        now = get_current_datetime()
+        has_reminder = self.db.reminder_manager.get_user_reminder(user_id)
 
-            now = get_current_datetime()
-            has_reminder = self.db.reminder_manager.get_user_reminder(user_id)
+        await self._edit_text(
+            query,
+            f"🏫 **Система заказа школьного питания**\n\n"
+            f"📅 Сегодня: {now.strftime('%d.%m.%Y')}\n"
+            f"Выберите действие:",
+            parse_mode='Markdown',
+            reply_markup=KB.main(has_reminder)
+        )
 
-            await query.edit_message_text(
-                f"🏫 **Система заказа школьного питания**\n\n"
-                f"📅 Сегодня: {now.strftime('%d.%m.%Y')}\n"
-                f"Выберите действие:",
-                parse_mode='Markdown',
-                reply_markup=KB.main(has_reminder)
+    async def _handle_back_dates(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Возвращает к выбору даты"""
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            await self._edit_text(
+                query,
+                "❌ Сессия устарела. Начните заново.",
+                reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
             )
+            return
 
-        elif data == "back_dates":
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                await query.edit_message_text(
-                    "❌ Сессия устарела. Начните заново.",
-                    reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
-                )
-                return
+        dates = self.db.get_working_dates(10)
 
-            dates = self.db.get_working_dates(10)
-            student_info = self.user_sessions[user_id]
+        await self._edit_text(
+            query,
+            f"👤 **{student_info['student_name']}**\n"
+            f"🏫 Класс: {student_info['class_name']}\n\n"
+            f"Выберите дату (🔒 - редактирование закрыто):",
+            parse_mode='Markdown',
+            reply_markup=KB.dates(dates)
+        )
+        return self.DATES
 
-            await query.edit_message_text(
-                f"👤 **{student_info['student_name']}**\n"
-                f"🏫 Класс: {student_info['class_name']}\n\n"
-                f"Выберите дату (🔒 - редактирование закрыто):",
-                parse_mode='Markdown',
-                reply_markup=KB.dates(dates)
+    async def _handle_date(self, query, user_id: int, date_str: str, context: ContextTypes.DEFAULT_TYPE):
+        """Показывает заказ на выбранную дату"""
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            await self._edit_text(
+                query,
+                "❌ Сессия устарела. Начните заново.",
+                reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
             )
-            return self.DATES
+            return
 
-        elif data.startswith("date|"):
-            date_str = data.split("|")[1]
+        orders = await self._run_db(self.db.get_student_orders, student_info['student_id'], date_str)
 
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                await query.edit_message_text(
-                    "❌ Сессия устарела. Начните заново.",
-                    reply_markup=KB.main(self.db.reminder_manager.get_user_reminder(user_id))
-                )
-                return
+        await self._edit_text(
+            query,
+            f"📅 **{format_date(date_str)}**\n"
+            f"👤 {student_info['student_name']}\n"
+            f"🏫 {student_info['class_name']}",
+            parse_mode='Markdown',
+            reply_markup=KB.meals(date_str, orders)
+        )
+        return self.MEALS
+
+    async def _handle_locked(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Сообщает о закрытой дате"""
+        await self._send_temp_message(
+            query.message.chat_id,
+            "⛔ Редактирование заказов на эту дату закрыто",
+            context
+        )
+        return self.MEALS
 
-            student_info = self.user_sessions[user_id]
-            orders = self.db.get_student_orders(student_info['student_id'], date_str)
+    async def _handle_meal(self, query, user_id: int, arg: str, context: ContextTypes.DEFAULT_TYPE):
+        """Переключает один прием пищи"""
+        date_str, _, meal_type = arg.partition("|")
 
-            await query.edit_message_text(
-                f"📅 **{datetime.strptime(date_str, '%Y-%m-%d').strftime('%d.%m.%Y')}**\n"
-                f"👤 {student_info['student_name']}\n"
-                f"🏫 {student_info['class_name']}",
-                parse_mode='Markdown',
-                reply_markup=KB.meals(date_str, orders)
-            )
-            return self.MEALS
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            return
 
-        elif data == "locked":
+        # Проверяем можно ли редактировать
+        target_date = parse_date(date_str)
+        if is_date_locked(target_date):
             await self._send_temp_message(
                 query.message.chat_id,
-                "⛔ Редактирование заказов на эту дату закрыто",
+                f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
                 context
             )
             return self.MEALS
 
-        elif data.startswith("meal|"):
-            _, date_str, meal_type = data.split("|")
-
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                return
-
-            student_info = self.user_sessions[user_id]
-
-            # Проверяем можно ли редактировать
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            if is_date_locked(target_date):
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
-                    context
-                )
-                return self.MEALS
-
-            # Получаем и обновляем заказы
-            orders = self.db.get_student_orders(student_info['student_id'], date_str)
-            orders[meal_type] = not orders[meal_type]
-
-            # Сохраняем
-            if self.db.save_order(student_info['student_id'], date_str, orders):
-                await query.edit_message_reply_markup(
-                    KB.meals(date_str, orders)
-                )
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "✅ Заказ обновлен",
-                    context
-                )
-            else:
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "❌ Ошибка сохранения заказа",
-                    context
-                )
-
-        elif data.startswith("all_day|"):
-            date_str = data.split("|")[1]
-
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                return
-
-            # Проверяем можно ли редактировать
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            if is_date_locked(target_date):
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
-                    context
-                )
-                return self.MEALS
-
-            # Заказываем всё на день
-            orders = {meal.value: True for meal in MealType}
-
-            if self.db.save_order(self.user_sessions[user_id]['student_id'], date_str, orders):
-                await query.edit_message_reply_markup(
-                    KB.meals(date_str, orders)
-                )
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "✅ Заказано всё питание на день",
-                    context
-                )
-
-        elif data.startswith("none_day|"):
-            date_str = data.split("|")[1]
-
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                return
-
-            # Проверяем можно ли редактировать
-            target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-            if is_date_locked(target_date):
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
-                    context
-                )
-                return self.MEALS
-
-            # Отменяем всё на день
-            orders = {meal.value: False for meal in MealType}
-
-            if self.db.save_order(self.user_sessions[user_id]['student_id'], date_str, orders):
-                await query.edit_message_reply_markup(
-                    KB.meals(date_str, orders)
-                )
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    "❌ Питание на день отменено",
-                    context
-                )
-
-        elif data.startswith("all_week|"):
-            date_str = data.split("|")[1]
-
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                return
-
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-            monday = date_obj - timedelta(days=date_obj.weekday())
-
-            success = 0
-            total = 0
-
-            for i in range(5):  # Понедельник - Пятница
-                week_date = monday + timedelta(days=i)
-                week_date_str = week_date.strftime("%Y-%m-%d")
-
-                # Пропускаем заблокированные даты
-                if is_date_locked(week_date.date()):
-                    continue
+        # Читаем текущий заказ из базы и сохраняем изменение за одну операцию,
+        # чтобы не затереть изменения с другого аккаунта того же ученика
+        orders = await self._run_db(self.db.toggle_meal, student_info['student_id'], date_str, meal_type,
+                                    student_info.get('student'))
+        if orders is not None:
+            await self._edit_markup(
+                query,
+                KB.meals(date_str, orders)
+            )
+            await self._send_temp_message(
+                query.message.chat_id,
+                "✅ Заказ обновлен",
+                context
+            )
+        else:
+            await self._send_temp_message(
+                query.message.chat_id,
+                "❌ Ошибка сохранения заказа",
+                context
+            )
 
-                total += 1
-                orders = {meal.value: True for meal in MealType}
+    async def _handle_all_day(self, query, user_id: int, date_str: str, context: ContextTypes.DEFAULT_TYPE):
+        """Заказывает всё питание на день"""
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            return
 
-                if self.db.save_order(self.user_sessions[user_id]['student_id'], week_date_str, orders):
-                    success += 1
+        # Проверяем можно ли редактировать
+        target_date = parse_date(date_str)
+        if is_date_locked(target_date):
+            await self._send_temp_message(
+                query.message.chat_id,
+                f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
+                context
+            )
+            return self.MEALS
 
-            if success > 0:
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    f"✅ Заказано питание на {success} дней недели",
-                    context
-                )
+        # Заказываем всё на день
+        orders = {meal.value: True for meal in MealType}
 
-            # Обновляем текущий день
-            current_orders = self.db.get_student_orders(
-                self.user_sessions[user_id]['student_id'], date_str
+        if await self._run_db(self.db.save_order, student_info['student_id'], date_str, orders,
+                              student_info.get('student')):
+            await self._edit_markup(
+                query,
+                KB.meals(date_str, orders)
             )
-            await query.edit_message_reply_markup(
-                KB.meals(date_str, current_orders)
+            await self._send_temp_message(
+                query.message.chat_id,
+                "✅ Заказано всё питание на день",
+                context
             )
 
-        elif data.startswith("clear_week|"):
-            date_str = data.split("|")[1]
+    async def _handle_none_day(self, query, user_id: int, date_str: str, context: ContextTypes.DEFAULT_TYPE):
+        """Отменяет питание на день"""
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            return
 
-            if user_id not in self.user_sessions or 'student_id' not in self.user_sessions[user_id]:
-                return
+        # Проверяем можно ли редактировать
+        target_date = parse_date(date_str)
+        if is_date_locked(target_date):
+            await self._send_temp_message(
+                query.message.chat_id,
+                f"⛔ Редактирование заказов на эту дату закрыто (дедлайн: {Config.DEADLINE_TIME.strftime('%H:%M')})",
+                context
+            )
+            return self.MEALS
 
-            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-            monday = date_obj - timedelta(days=date_obj.weekday())
+        # Отменяем всё на день
+        orders = {meal.value: False for meal in MealType}
 
-            success = 0
-            total = 0
+        if await self._run_db(self.db.save_order, student_info['student_id'], date_str, orders,
+                              student_info.get('student')):
+            await self._edit_markup(
+                query,
+                KB.meals(date_str, orders)
+            )
+            await self._send_temp_message(
+                query.message.chat_id,
+                "❌ Питание на день отменено",
+                context
+            )
 
-            for i in range(5):  # Понедельник - Пятница
-                week_date = monday + timedelta(days=i)
-                week_date_str = week_date.strftime("%Y-%m-%d")
+    async def _handle_all_week(self, query, user_id: int, date_str: str, context: ContextTypes.DEFAULT_TYPE):
+        """Заказывает питание на неделю"""
+        await self._set_week_meals(query, user_id, date_str, True, "✅ Заказано питание на {} дней недели", context)
 
-                # Пропускаем заблокированные даты
-                if is_date_locked(week_date.date()):
-                    continue
+    async def _handle_clear_week(self, query, user_id: int, date_str: str, context: ContextTypes.DEFAULT_TYPE):
+        """Отменяет питание на неделю"""
+        await self._set_week_meals(query, user_id, date_str, False, "❌ Питание отменено на {} дней недели", context)
 
-                total += 1
-                orders = {meal.value: False for meal in MealType}
+    async def _set_week_meals(self, query, user_id: int, date_str: str, enabled: bool, done_text: str,
+                              context: ContextTypes.DEFAULT_TYPE):
+        """Заказывает или отменяет всё питание на неделю, в которую входит дата"""
+        student_info = await self.user_sessions.get(user_id)
+        if not student_info or 'student_id' not in student_info:
+            return
 
-                if self.db.save_order(self.user_sessions[user_id]['student_id'], week_date_str, orders):
-                    success += 1
+        # Понедельник - Пятница; заблокированные даты пропускает save_orders_bulk
+        updates = [
+            (week_date.isoformat(), {meal.value: enabled for meal in MealType})
+            for week_date in get_week_dates(date_str)
+        ]
 
-            if success > 0:
-                await self._send_temp_message(
-                    query.message.chat_id,
-                    f"❌ Питание отменено на {success} дней недели",
-                    context
-                )
+        # Сохраняем всю неделю за один раз
+        success = await self._run_db(
+            self.db.save_orders_bulk, student_info['student_id'], updates,
+            student_info.get('student')
+        )
 
-            # Обновляем текущий день
-            current_orders = self.db.get_student_orders(
-                self.user_sessions[user_id]['student_id'], date_str
+        if success > 0:
+            await self._send_temp_message(
+                query.message.chat_id,
+                done_text.format(success),
+                context
             )
-            await query.edit_message_reply_markup(
-                KB.meals(date_str, current_orders)
+
+        # Обновляем текущий день: он входит в эту неделю,
+        # и если не заблокирован, его заказ только что записан
+        if success and not is_date_locked(parse_date(date_str)):
+            current_orders = {meal.value: enabled for meal in MealType}
+        else:
+            current_orders = await self._run_db(
+                self.db.get_student_orders, student_info['student_id'], date_str
             )
+        await self._edit_markup(
+            query,
+            KB.meals(date_str, current_orders)
+        )
 
     async def input_id_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик ввода ID ученика"""
@@ -1266,7 +1991,7 @@ class FoodBot:
             return self.INPUT_ID
 
         # Проверяем ID
-        ok, student_info = self.db.verify_student(student_id)
+        ok, student_info = await self._run_db(self.db.verify_student, student_id)
 
         if not ok:
             await update.message.reply_text(
@@ -1283,6 +2008,7 @@ class FoodBot:
             'student_id': student_id,
             'student_name': student_info.full_name,
             'class_name': student_info.class_name,
+            'student': student_info,
             'state': 'dates'
         }
 
@@ -1290,6 +2016,9 @@ class FoodBot:
         self.db.connection_manager.save_user_connection(
             user_id, student_id, student_info.full_name, student_info.class_name
         )
+        self.db.reminder_manager.set_reminder_target(
+            user_id, self.db.connection_manager.get_student_info_for_user(user_id)
+        )
 
         # Показываем доступные даты
         dates = self.db.get_working_dates(10)
@@ -1309,7 +2038,7 @@ class FoodBot:
     async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик отмены"""
         user_id = update.effective_user.id
-        if user_id in self.user_sessions:
+        if await self.user_sessions.get(user_id) is not None:
             self.user_sessions[user_id] = {'state': 'main'}
 
         has_reminder = self.db.reminder_manager.get_user_reminder(user_id)
@@ -1322,6 +2051,26 @@ class FoodBot:
     async def _send_temp_message(self, chat_id: int, text: str, context: ContextTypes.DEFAULT_TYPE, delay: int = 2):
         """Отправляет временное сообщение"""
         msg = await context.bot.send_message(chat_id=chat_id, text=text)
+        # Удаление планируем в JobQueue, чтобы обработчик не ждал delay секунд
+        if context.job_queue:
+            context.job_queue.run_once(
+                self._delete_temp_message, delay, chat_id=chat_id, data=msg.message_id
+            )
+            return
+
+        task = asyncio.create_task(self._delete_later(msg, delay))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _delete_temp_message(self, context: ContextTypes.DEFAULT_TYPE):
+        """Удаляет временное сообщение по заданию JobQueue"""
+        try:
+            await context.bot.delete_message(chat_id=context.job.chat_id, message_id=context.job.data)
+        except:
+            pass
+
+    async def _delete_later(self, msg, delay: int):
+        """Удаляет сообщение через delay секунд"""
         await asyncio.sleep(delay)
         try:
             await msg.delete()
@@ -1358,7 +2107,7 @@ class FoodBot:
 
         results = []
         for test_date, name in test_dates:
-            locked = is_date_locked(test_date)
+            locked = is_date_locked(test_date, now)
             results.append(f"{name} ({test_date}): {'🔒 ЗАБЛОКИРОВАНО' if locked else '✅ ДОСТУПНО'}")
 
         await update.message.reply_text(
@@ -1375,11 +2124,11 @@ class FoodBot:
         connection_info = self.db.connection_manager.get_student_info_for_user(user_id)
         has_connection = connection_info is not None
 
-        tomorrow = (get_current_datetime() + timedelta(days=1)).strftime("%Y-%m-%d")
+        tomorrow = (get_current_datetime().date() + timedelta(days=1)).isoformat()
 
         if has_connection:
             student_id = connection_info['student_id']
-            orders = self.db.get_student_orders(student_id, tomorrow)
+            orders = await self._run_db(self.db.get_student_orders, student_id, tomorrow)
             has_order = any(orders.values())
 
             order_status = "✅ Есть заказ" if has_order else "❌ Нет заказа"
@@ -1415,8 +2164,8 @@ class FoodBot:
             return
 
         # Проверяем заказ на завтра
-        tomorrow = (get_current_datetime() + timedelta(days=1)).strftime("%Y-%m-%d")
-        orders = self.db.get_student_orders(connection_info['student_id'], tomorrow)
+        tomorrow = (get_current_datetime().date() + timedelta(days=1)).isoformat()
+        orders = await self._run_db(self.db.get_student_orders, connection_info['student_id'], tomorrow)
         has_order = any(orders.values())
 
         # Получаем статус напоминаний
@@ -1449,6 +2198,7 @@ class FoodBot:
         user_id = update.effective_user.id
 
         self.db.connection_manager.remove_user_connection(user_id)
+        self.db.reminder_manager.set_reminder_target(user_id, None)
 
         await update.message.reply_text(
             "✅ Связь с учеником очищена.\n"
@@ -1465,10 +2215,41 @@ class FoodBot:
 
         try:
             # Запускаем отправку напоминаний
-            await update.message.reply_text("✅ Тестовое напоминание отправлено")
+            sent = await self.send_reminders(context)
+            await update.message.reply_text(f"✅ Тестовое напоминание отправлено ({sent})")
         except Exception as e:
             await update.message.reply_text(f"❌ Ошибка: {e}")
 
+    async def reload_students(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Перечитать список учеников из students.xlsx (только для админов)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+
+        count = await self._run_db(self.db.reload_students)
+        await update.message.reply_text(f"✅ Список учеников обновлен: {count}")
+
+    async def sessions_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Показать количество активных сессий (только для админов)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+
+        await update.message.reply_text(
+            f"👥 Активных сессий: {len(self.user_sessions)} из {Config.MAX_SESSIONS}\n"
+            f"⏱️ Время жизни сессии: {Config.SESSION_TTL // 60} мин"
+        )
+
+    async def export_xlsx(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Выгрузить заказы из базы в xlsx (только для админов)"""
+        if update.effective_user.id not in Config.ADMIN_IDS:
+            return
+
+        orders_data = await self._run_db(self.db.export_orders)
+        await update.message.reply_document(
+            document=orders_data,
+            filename="orders.xlsx",
+            caption="📊 Файл заказов"
+        )
+
 
 # ================== ЗАПУСК ==================
 def main():
@@ -1482,15 +2263,28 @@ def main():
         print("=" * 50)
         return
 
+    # Цикл событий на uvloop, если он установлен
+    if uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
     # Создаем приложение
+    # block=False: обработчики не ждут друг друга, порядок действий пользователя держит _user_lock
     application = (
         Application.builder()
         .token(Config.BOT_TOKEN)
+        .defaults(Defaults(block=False))
+        .concurrent_updates(Config.CONCURRENT_UPDATES)
+        .connection_pool_size(Config.CONNECTION_POOL_SIZE)
+        .pool_timeout(30)
+        # Соблюдаем лимиты Telegram: при массовых нажатиях запросы ждут в очереди, а не получают ошибку
+        .rate_limiter(AIORateLimiter())
         .build()
     )
 
     # Создаем бота и передаем ему application
     bot = FoodBot(application)
+    application.post_init = bot.post_init
+    application.post_shutdown = bot.post_shutdown
 
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", bot.start))
@@ -1501,6 +2295,9 @@ def main():
     application.add_handler(CommandHandler("check_reminder", bot.check_reminder))
     application.add_handler(CommandHandler("clear", bot.clear_connection))
     application.add_handler(CommandHandler("test_now", bot.test_reminder_now))
+    application.add_handler(CommandHandler("export_xlsx", bot.export_xlsx))
+    application.add_handler(CommandHandler("sessions", bot.sessions_info))
+    application.add_handler(CommandHandler("reload", bot.reload_students))
 
     # Добавляем ConversationHandler для ввода ID
     conv_handler = ConversationHandler(
@@ -1562,6 +2359,9 @@ def main():
     print("/check_reminder - проверить статус напоминаний")
     print("/clear - очистить сохраненную связь с учеником")
     print("/test_now - немедленно отправить тестовое напоминание (админ)")
+    print("/export_xlsx - выгрузить заказы в xlsx (админ)")
+    print("/sessions - количество активных сессий (админ)")
+    print("/reload - перечитать список учеников (админ)")
     print("=" * 50 + "\n")
 
     try: